@@ -9,6 +9,8 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from google.oauth2 import service_account
 
+from run_journal import load_blob, store_blob
+
 # ===== CONFIG =====
 SCOPES = ["https://www.googleapis.com/auth/drive"]
 SERVICE_ACCOUNT_FILE = "credentials.json"
@@ -45,7 +47,7 @@ def list_files_in_folder(folder_id: str) -> List[Dict[str, Any]]:
     results = drive_service.files().list(
         q=f"'{folder_id}' in parents and trashed = false",
         pageSize=1000,
-        fields="files(id,name,mimeType)",
+        fields="files(id,name,mimeType,md5Checksum,modifiedTime)",
         includeItemsFromAllDrives=True,
         supportsAllDrives=True,
     ).execute()
@@ -64,6 +66,20 @@ def download_file(file_id: str) -> bytes:
     return fh.read()
 
 
+def fetch_file(f: Dict[str, Any]) -> bytes:
+    """
+    Как download_file, но через локальный кэш по md5Checksum:
+    файл, уже скачанный в прошлом (упавшем) прогоне, повторно не качается.
+    """
+    md5 = f.get("md5Checksum")
+    cached = load_blob(md5)
+    if cached is not None:
+        return cached
+    content = download_file(f["id"])
+    store_blob(md5, content)
+    return content
+
+
 def _find_subfolder_by_name(parent_id: str, expected: str) -> Optional[Dict[str, Any]]:
     """Ищет подпапку с именем expected (регистронезависимо, без лишних пробелов)."""
     expected_norm = expected.strip().lower()
@@ -91,7 +107,7 @@ def find_boq_file(project_folder_id: str) -> Tuple[Optional[str], Optional[bytes
 
     boq_file = boq_files[0]
     print(f"[INFO] BOQ file: {boq_file['name']}")
-    return boq_file["name"], download_file(boq_file["id"])
+    return boq_file["name"], fetch_file(boq_file)
 
 
 _SUPPLIER_BLACKLIST = {
@@ -111,11 +127,14 @@ def _guess_supplier_from_filename(filename: str) -> str:
     return base.strip()
 
 
-def find_rfq_files(project_folder_id: str) -> List[Dict[str, Any]]:
+def find_rfq_files(project_folder_id: str) -> Tuple[List[Dict[str, Any]], List[str]]:
     """
     Ищем предложения в подпапке 'rfq' (без подпапок).
     Fallback: 'кп' / 'kp' — для обратной совместимости.
-    Возвращаем список элементов: {"supplier", "filename", "bytes"}.
+    Возвращаем (offers, fetch_errors):
+      - offers: список элементов {"supplier", "filename", "modified", "bytes"};
+      - fetch_errors: имена файлов, которые не удалось скачать (проект неполный, стоит повторить).
+    Один поставщик может прислать несколько файлов — они сводятся уже после парсинга.
     """
     rfq_folder = (
         _find_subfolder_by_name(project_folder_id, "rfq")
@@ -124,23 +143,30 @@ def find_rfq_files(project_folder_id: str) -> List[Dict[str, Any]]:
     )
     if not rfq_folder:
         print("[WARN] 'rfq' folder not found (also no 'кп'/'kp')")
-        return []
+        return [], []
 
     offers: List[Dict[str, Any]] = []
+    fetch_errors: List[str] = []
     files = list_files_in_folder(rfq_folder["id"])
     for f in files:
         # пропускаем подпапки (на всякий)
         if f.get("mimeType") == "application/vnd.google-apps.folder":
             continue
         try:
-            content = download_file(f["id"])
+            content = fetch_file(f)
             supplier = _guess_supplier_from_filename(f["name"])
-            offers.append({"supplier": supplier, "filename": f["name"], "bytes": content})
+            offers.append({
+                "supplier": supplier,
+                "filename": f["name"],
+                "modified": f.get("modifiedTime", ""),
+                "bytes": content,
+            })
         except Exception as e:
             print(f"[ERROR] download RFQ '{f['name']}': {e}")
+            fetch_errors.append(f["name"])
 
     print(f"[INFO] RFQ files found: {len(offers)}")
-    return offers
+    return offers, fetch_errors
 
 
 # ===== PUBLIC API (единый контракт) =====
@@ -153,10 +179,14 @@ def get_projects_from_drive(root_folder_id: Optional[str] = None, *_args, **_kwa
       "boq_file": str | None,
       "boq_bytes": bytes | None,
       "offers": [
-        {"supplier": str, "filename": str, "bytes": bytes}
-      ]
+        {"supplier": str, "filename": str, "modified": str (RFC 3339), "bytes": bytes}
+      ],
+      "fetch_errors": [str]  # RFQ-файлы, которые не скачались
     }
 
+    Если корневая папка или список проектов недоступны (5xx Drive и т.п.) — бросает исключение,
+    а не возвращает пустой список: пустой ответ нельзя путать с «проектов нет».
+
     Параметры:
       - root_folder_id: опционально переопределяет ROOT_FOLDER_ID
       - *_args, **_kwargs: «проглатывают» лишние аргументы, если функция вызвана как колбэк
@@ -170,7 +200,7 @@ def get_projects_from_drive(root_folder_id: Optional[str] = None, *_args, **_kwa
         print(f"[INFO] Scanning ROOT: {root.get('name')} ({root.get('id')})")
     except Exception as e:
         print(f"[ERROR] Cannot access ROOT '{folder_id}': {e}")
-        return projects
+        raise
 
     project_folders = list_folders_in_folder(folder_id)
     print(f"[INFO] Project folders discovered: {len(project_folders)}")
@@ -182,13 +212,14 @@ def get_projects_from_drive(root_folder_id: Optional[str] = None, *_args, **_kwa
             print("[WARN] Skip project — BOQ missing")
             continue
 
-        offers = find_rfq_files(pf["id"])
+        offers, fetch_errors = find_rfq_files(pf["id"])
         projects.append(
             {
                 "project_name": pf["name"],
                 "boq_file": boq_name,
                 "boq_bytes": boq_bytes,
                 "offers": offers,
+                "fetch_errors": fetch_errors,
             }
         )
 
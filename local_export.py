@@ -0,0 +1,197 @@
+# local_export.py
+# -*- coding: utf-8 -*-
+"""
+Локальная выгрузка сводной таблицы (альтернатива/дополнение к Google Sheets):
+- <EXPORT_DIR>/<project>.xlsx — openpyxl в режиме write_only, строки пишутся блоками.
+- <EXPORT_DIR>/<project>.parquet (или .csv) — сайдкар с теми же данными, тоже блоками.
+- Таблица сводится блоками прямо в воркере из BOQ и индексов цен — целиком она нигде не собирается.
+- Проекты выгружаются параллельно в пуле процессов (openpyxl — чистый Python, потоки не помогут).
+"""
+
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import re
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from processor import iter_aligned_blocks
+
+OUTPUT_MODES = ("sheets", "local", "both")
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "sheets").strip().lower()
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_SIDECAR = os.getenv("EXPORT_SIDECAR", "parquet").strip().lower()  # parquet | csv
+EXPORT_BLOCK_ROWS = int(os.getenv("EXPORT_BLOCK_ROWS", "5000"))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "0")) or None
+
+_bad_chars = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+_bad_title_chars = re.compile(r"[\\/*?:\[\]\x00-\x1f]+")  # что Excel не допускает в имени листа
+
+
+def validate_output_mode() -> None:
+    if OUTPUT_MODE not in OUTPUT_MODES:
+        raise ValueError(f"Unknown OUTPUT_MODE '{OUTPUT_MODE}', expected one of {OUTPUT_MODES}")
+
+
+def sheets_enabled() -> bool:
+    return OUTPUT_MODE in ("sheets", "both")
+
+
+def local_enabled() -> bool:
+    return OUTPUT_MODE in ("local", "both")
+
+
+def _safe_filename(name: str) -> str:
+    s = _bad_chars.sub("_", name).strip(" .")
+    return s or "project"
+
+
+def _safe_sheet_title(name: str) -> str:
+    # не больше 31 символа, без апострофа в начале/конце
+    s = _bad_title_chars.sub("_", name)[:31].strip(" '")
+    return s or "Sheet1"
+
+
+def _cell(v):
+    # openpyxl не понимает numpy-скаляры и NaN
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float) and np.isnan(v):
+        return None
+    return v
+
+
+class _CsvSidecar:
+    def __init__(self, path: str):
+        self.path = path
+        self.header = True
+
+    def write(self, block: pd.DataFrame) -> None:
+        block.to_csv(self.path, mode="w" if self.header else "a", header=self.header, index=False)
+        self.header = False
+
+    def close(self) -> None:
+        pass
+
+
+class _ParquetSidecar:
+    def __init__(self, path: str, columns: pd.Index, dtypes: pd.Series):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        # числовые колонки пишем как есть, остальные (No, Match, Notes, ... — object или string dtype,
+        # нередко смешанных типов) — строками
+        self._str_cols = [c for c in columns if not pd.api.types.is_numeric_dtype(dtypes[c])]
+        fields = [
+            pa.field(str(c), pa.string() if c in self._str_cols
+                     else pa.from_numpy_dtype(np.dtype(getattr(dtypes[c], "numpy_dtype", dtypes[c]))))
+            for c in columns
+        ]
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, block: pd.DataFrame) -> None:
+        block = block.copy()
+        for c in self._str_cols:
+            block[c] = block[c].map(lambda v: "" if pd.isna(v) else str(v))
+        block.columns = [str(c) for c in block.columns]
+        self.writer.write_table(self._pa.Table.from_pandas(block, schema=self.schema, preserve_index=False))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def _open_sidecar(base: str, block: pd.DataFrame) -> Tuple[object, str]:
+    """Открывает сайдкар во временном файле; возвращает (writer, итоговый путь)."""
+    if EXPORT_SIDECAR == "parquet":
+        try:
+            return _ParquetSidecar(base + ".parquet.tmp", block.columns, block.dtypes), base + ".parquet"
+        except ImportError:
+            print("[WARN] pyarrow not installed — writing CSV sidecar instead")
+    return _CsvSidecar(base + ".csv.tmp"), base + ".csv"
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def write_table_blocks(project_name: str, blocks: Iterable[pd.DataFrame], out_dir: Optional[str] = None) -> str:
+    """
+    Пишет блоки сводной таблицы в <out_dir>/<project>.xlsx + сайдкар по мере их поступления.
+    Оба файла пишутся во временные и подменяются только после успешной записи обоих —
+    при ошибке старая выгрузка остаётся целой. Возвращает путь к xlsx.
+    """
+    from openpyxl import Workbook
+
+    out_dir = out_dir or EXPORT_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, _safe_filename(project_name))
+    xlsx_path = base + ".xlsx"
+    xlsx_tmp = xlsx_path + ".tmp"
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=_safe_sheet_title(project_name))
+
+    sidecar, sidecar_path = None, None
+    try:
+        try:
+            for block in blocks:
+                if sidecar is None:
+                    ws.append([str(c) for c in block.columns])
+                    sidecar, sidecar_path = _open_sidecar(base, block)
+                for row in block.itertuples(index=False, name=None):
+                    ws.append([_cell(v) for v in row])
+                sidecar.write(block)
+        finally:
+            if sidecar is not None:
+                sidecar.close()
+        wb.save(xlsx_tmp)
+    except BaseException:
+        try:
+            ws.close()  # иначе незакрытый поток строк openpyxl ругается при сборке мусора
+        except Exception:
+            pass
+        if sidecar_path is not None:
+            _remove_quietly(sidecar_path + ".tmp")
+        _remove_quietly(xlsx_tmp)
+        raise
+
+    if sidecar is not None:
+        os.replace(sidecar_path + ".tmp", sidecar_path)
+    os.replace(xlsx_tmp, xlsx_path)
+    return xlsx_path
+
+
+def export_project(project_name: str, boq_df: pd.DataFrame, supplier_to_index: Dict[str, Dict[Tuple[str, str], float]],
+                   out_dir: Optional[str] = None, block_rows: Optional[int] = None) -> str:
+    """
+    Сводит BOQ с индексами цен блоками по block_rows строк (iter_aligned_blocks) и сразу пишет каждый блок:
+    полная таблица BOQ × поставщики не собирается ни здесь, ни в главном процессе.
+    """
+    blocks = iter_aligned_blocks(boq_df, supplier_to_index, block_rows or EXPORT_BLOCK_ROWS)
+    return write_table_blocks(project_name, blocks, out_dir)
+
+
+class ExportPool:
+    """Параллельная выгрузка проектов: submit() сразу возвращает Future, пока главный цикл идёт дальше."""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        # не fork: воркер не должен наследовать память главного процесса (все скачанные файлы)
+        method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        self._pool = ProcessPoolExecutor(max_workers=max_workers or EXPORT_WORKERS, mp_context=mp.get_context(method))
+
+    def submit(self, project_name: str, boq_df: pd.DataFrame,
+               supplier_to_index: Dict[str, Dict[Tuple[str, str], float]]) -> Future:
+        # в воркер уходят только BOQ и индексы цен — таблица собирается там блоками
+        return self._pool.submit(export_project, project_name, boq_df, supplier_to_index)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
@@ -3,31 +3,162 @@ import os
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from drive_client import get_projects_from_drive
-from processor import parse_boq, parse_rfq, align_offers
-from sheets_client import write_project_sheet
+# Несколько файлов одного поставщика: newest — цена из самого свежего файла, lowest — минимальная
+OFFER_PRECEDENCE = os.getenv("OFFER_PRECEDENCE", "newest").strip().lower()
 
-if __name__ == "__main__":
-    projects = get_projects_from_drive()
+
+def main() -> None:
+    # Импорты внутри main(): воркеры пулов (forkserver/spawn) заново импортируют __main__,
+    # и без этого каждый из них поднимал бы клиентов Drive/Sheets.
+    from drive_client import get_projects_from_drive
+    from local_export import ExportPool, local_enabled, sheets_enabled, validate_output_mode
+    from parse_executor import ParseJob, iter_parse_jobs
+    from processor import OFFER_PRECEDENCES, align_offers, build_price_index
+    from run_journal import RunJournal, combined_hash, content_hash
+    from sheets_client import write_project_sheet
+
+    validate_output_mode()
+    if OFFER_PRECEDENCE not in OFFER_PRECEDENCES:
+        raise ValueError(f"Unknown OFFER_PRECEDENCE '{OFFER_PRECEDENCE}', expected one of {OFFER_PRECEDENCES}")
+
+    journal = RunJournal()
+
+    try:
+        projects = get_projects_from_drive()
+    except Exception as e:
+        # Drive недоступен: синхронизация остаётся открытой, следующий запуск её продолжит
+        print(f"🔴 Drive listing failed, sync {journal.state['sync_id']} stays open: {e}")
+        return
     print(f"🟢 Найдено проектов: {len(projects)}")
+
+    # Хэши входов: файл -> sha256, проект -> хэш всех его файлов
+    for p in projects:
+        p["boq_hash"] = content_hash(p["boq_bytes"])
+        for off in p["offers"]:
+            off["hash"] = content_hash(off["bytes"])
+        p["inputs_hash"] = combined_hash(
+            OFFER_PRECEDENCE,
+            p["boq_hash"],
+            *(f"{off['supplier']}|{off['filename']}|{off.get('modified', '')}|{off['hash']}" for off in p["offers"]),
+        )
+        if not p["fetch_errors"]:
+            journal.mark_done(p["project_name"], "fetched", p["inputs_hash"])
+
+    # Парсинг всех BOQ/RFQ всех проектов — параллельно, в пуле процессов.
+    # Уже разобранные в этой синхронизации файлы (и одинаковые файлы в разных проектах) не парсим повторно.
+    parsed = {}
+    jobs = []
+    for p in projects:
+        if journal.is_settled(p["project_name"], p["inputs_hash"]):
+            continue
+        if journal.is_done(p["project_name"], "aligned", p["inputs_hash"]):
+            p["aligned"] = journal.load_artifact("indexes", p["inputs_hash"])
+            if p["aligned"] is not None:
+                continue
+            # артефакт пропал или не читается (например, после обновления pandas) — пересчитываем
+            journal.clear_stage(p["project_name"], "aligned")
+        files = [("boq", p["boq_hash"], p["boq_bytes"])] + [("rfq", off["hash"], off["bytes"]) for off in p["offers"]]
+        for kind, h, data in files:
+            key = (kind, h)
+            if key in parsed:
+                continue
+            parsed[key] = journal.load_artifact("parsed", f"{kind}-{h}")
+            if parsed[key] is None:
+                jobs.append(ParseJob(kind, data, tag=key))
+    # Сохраняем каждый результат сразу: падение посреди парсинга не теряет уже разобранное.
+    # Неудачи не кэшируем — при продолжении файл попробуем снова.
+    for _, res in iter_parse_jobs(jobs):
+        parsed[res.tag] = res
+        if res.ok:
+            journal.save_artifact("parsed", "-".join(res.tag), res)
+
+    export_pool = ExportPool() if local_enabled() else None
+    exports = []
+
     for p in projects:
         project_name = p["project_name"]
+        inputs_hash = p["inputs_hash"]
         print(f"📁 {project_name} | BOQ: {p['boq_file']} | RFQ: {len(p['offers'])}")
 
-        # Парсинг BOQ
-        boq_df = parse_boq(p["boq_bytes"])
+        if journal.is_done(project_name, "written", inputs_hash):
+            print("   ⏭ Already written in this sync")
+            continue
+        if journal.is_done(project_name, "failed", inputs_hash):
+            print("   ⏭ Already failed in this sync")
+            continue
 
-        # Парсинг RFQ: имя файла -> df
-        supplier_to_df = {}
-        for off in p["offers"]:
-            try:
-                df = parse_rfq(off["bytes"])
-                supplier_to_df[off["supplier"]] = df
-                print(f"   — OK RFQ {off['supplier']}: {off['filename']}")
-            except Exception as e:
-                print(f"   — FAIL RFQ {off['filename']}: {e}")
-
-        # Сведение и запись в Sheet
-        suppliers, table = align_offers(boq_df, supplier_to_df)
-        write_project_sheet(project_name, table)
-        print(f"   ✅ Sheet updated: {project_name} ({len(suppliers)} suppliers)")
+        # Проект неполный (файл не скачался, таймаут/падение воркера): пишем что есть,
+        # но стадии не закрываем — следующий запуск повторит недоделанное.
+        incomplete = bool(p["fetch_errors"])
+        for name in p["fetch_errors"]:
+            print(f"   — FAIL RFQ {name}: download failed")
+
+        aligned = p.get("aligned")
+        if aligned is None:
+            boq_res = parsed[("boq", p["boq_hash"])]
+            if not boq_res.ok:
+                print(f"   — FAIL BOQ {p['boq_file']}: {boq_res.error}")
+                if not boq_res.transient:
+                    journal.mark_failed(project_name, inputs_hash, boq_res.error)
+                continue
+            boq_df = boq_res.df
+
+            # RFQ: поставщик -> все его файлы (в исходном порядке файлов — результат детерминирован)
+            supplier_files = {}
+            for off in p["offers"]:
+                res = parsed[("rfq", off["hash"])]
+                if res.ok:
+                    supplier_files.setdefault(off["supplier"], []).append((res.df, off.get("modified")))
+                    print(f"   — OK RFQ {off['supplier']}: {off['filename']}")
+                else:
+                    print(f"   — FAIL RFQ {off['filename']}: {res.error}")
+                    incomplete = incomplete or res.transient
+            if not incomplete:
+                journal.mark_done(project_name, "parsed", inputs_hash)
+
+            # Сведение: один индекс цен на поставщика. Сама таблица BOQ × поставщики строится при записи:
+            # для Sheets — целиком, для локальной выгрузки — блоками в воркере.
+            supplier_to_index = {
+                supplier: build_price_index(parts, OFFER_PRECEDENCE)
+                for supplier, parts in supplier_files.items()
+            }
+            aligned = (boq_df, supplier_to_index)
+            if not incomplete:
+                journal.save_artifact("indexes", inputs_hash, aligned)
+                journal.mark_done(project_name, "aligned", inputs_hash)
+
+        # Запись в Sheet и/или локальная выгрузка (в фоне, параллельно с остальными проектами)
+        boq_df, supplier_to_index = aligned
+        if sheets_enabled():
+            suppliers, table = align_offers(boq_df, supplier_to_index)
+            write_project_sheet(project_name, table)
+            del table
+            print(f"   ✅ Sheet updated: {project_name} ({len(suppliers)} suppliers)")
+        if export_pool is not None:
+            fut = export_pool.submit(project_name, boq_df, supplier_to_index)
+            exports.append((project_name, inputs_hash, incomplete, fut))
+        elif not incomplete:
+            journal.mark_done(project_name, "written", inputs_hash)
+        if incomplete:
+            print(f"   ⚠️ Incomplete: {project_name} will be retried on the next run")
+
+    for project_name, inputs_hash, incomplete, fut in exports:
+        try:
+            path = fut.result()
+            if not incomplete:
+                journal.mark_done(project_name, "written", inputs_hash)
+            print(f"   💾 Exported: {project_name} -> {path}")
+        except Exception as e:
+            print(f"   — FAIL export {project_name}: {e}")
+    if export_pool is not None:
+        export_pool.shutdown()
+
+    # Синхронизация закрывается, только когда каждый проект записан или окончательно отбракован.
+    # Иначе следующий запуск продолжит её и повторит только недоделанное.
+    if all(journal.is_settled(p["project_name"], p["inputs_hash"]) for p in projects):
+        journal.finish_sync()
+    else:
+        print(f"🟡 Sync {journal.state['sync_id']} stays open")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# parse_executor.py
+# -*- coding: utf-8 -*-
+"""
+Параллельный парсинг BOQ/RFQ по процессам:
+- Пул из PARSE_WORKERS долгоживущих процессов, файлы раздаются по одному.
+- Жёсткий таймаут на файл (PARSE_TIMEOUT_SECONDS): зависший воркер убивается и заменяется новым.
+- Лимит памяти на воркер (PARSE_MEMORY_MB, RLIMIT_AS) — битый PDF не съест всю машину.
+- run_parse_jobs возвращает результаты строго в порядке заданий, независимо от порядка завершения.
+"""
+
+from __future__ import annotations
+
+import errno
+import multiprocessing as mp
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.connection import wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from processor import parse_boq, parse_rfq
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0")) or (os.cpu_count() or 1)
+PARSE_TIMEOUT_SECONDS = float(os.getenv("PARSE_TIMEOUT_SECONDS", "120"))
+PARSE_MEMORY_MB = int(os.getenv("PARSE_MEMORY_MB", "2048"))
+
+_PARSERS = {"boq": parse_boq, "rfq": parse_rfq}
+
+# Воркеры стартуют из чистого интерпретатора, а не fork'ом главного процесса:
+# иначе RLIMIT_AS считает и всё, что родитель держит в памяти (скачанные файлы всех проектов).
+if "forkserver" in mp.get_all_start_methods():
+    _CTX = mp.get_context("forkserver")
+    _CTX.set_forkserver_preload(["processor"])
+else:
+    _CTX = mp.get_context("spawn")
+
+
+@dataclass
+class ParseJob:
+    kind: str          # "boq" | "rfq"
+    data: bytes
+    tag: Any = None    # что угодно для вызывающего кода (проект, имя файла, ...)
+
+
+@dataclass
+class ParseResult:
+    tag: Any
+    df: Optional[pd.DataFrame] = None
+    error: Optional[str] = None
+    transient: bool = False  # таймаут/падение воркера — при следующем прогоне стоит повторить
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _limit_memory(mem_mb: int) -> None:
+    """Ограничивает адресное пространство текущего процесса (только POSIX)."""
+    if mem_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = mem_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError):
+        pass
+
+
+def _memory_error(mem_mb: int) -> str:
+    return f"memory limit exceeded ({mem_mb} MB)"
+
+
+def _parse_one(kind: str, data: bytes, mem_mb: int) -> Tuple[Optional[pd.DataFrame], Optional[str], bool]:
+    """(df, ошибка, нехватка памяти)"""
+    try:
+        return _PARSERS[kind](data), None, False
+    except MemoryError:
+        return None, _memory_error(mem_mb), True
+    except OSError as e:
+        # упёршись в RLIMIT_AS, C-код и загрузка модулей часто дают ENOMEM, а не MemoryError
+        if e.errno == errno.ENOMEM:
+            return None, _memory_error(mem_mb), True
+        return None, str(e) or type(e).__name__, False
+    except Exception as e:
+        return None, str(e) or type(e).__name__, False
+
+
+def _worker_loop(conn, mem_mb: int) -> None:
+    """Долгоживущий воркер: получает (kind, bytes), отвечает (df, ошибка, retire); None — выход."""
+    _limit_memory(mem_mb)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        df, error, oom = _parse_one(job[0], job[1], mem_mb)
+        try:
+            conn.send((df, error, oom))
+        except MemoryError:
+            oom = True
+            conn.send((None, _memory_error(mem_mb), oom))
+        # после нехватки памяти куча процесса в неизвестном состоянии — воркер уходит, его заменят
+        if oom:
+            break
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, mem_mb: int):
+        self.conn, child = _CTX.Pipe()
+        self.proc = _CTX.Process(target=_worker_loop, args=(child, mem_mb), daemon=True)
+        self.proc.start()
+        child.close()
+        self.job: Optional[int] = None
+        self.deadline = 0.0
+
+    def submit(self, i: int, job: ParseJob, timeout: float) -> None:
+        self.conn.send((job.kind, job.data))
+        self.job = i
+        self.deadline = time.monotonic() + timeout
+
+    def kill(self) -> None:
+        self.conn.close()
+        if self.proc.is_alive():
+            self.proc.kill()
+        self.proc.join()
+
+    def close(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.proc.join(timeout=5)
+        self.kill()
+
+
+def iter_parse_jobs(
+    jobs: List[ParseJob],
+    max_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    mem_mb: Optional[int] = None,
+) -> Iterator[Tuple[int, ParseResult]]:
+    """
+    Парсит задания в пуле из PARSE_WORKERS долгоживущих процессов.
+    Отдаёт (номер задания, ParseResult) по мере готовности — вызывающий код может сразу сохранять результат.
+    Зависший (таймаут) или упавший воркер убивается и заменяется новым.
+    Ошибки, таймауты и падения воркеров не бросаются, а попадают в ParseResult.error.
+    """
+    workers = max(1, max_workers or PARSE_WORKERS)
+    timeout = PARSE_TIMEOUT_SECONDS if timeout is None else timeout
+    mem_mb = PARSE_MEMORY_MB if mem_mb is None else mem_mb
+
+    pending = deque(range(len(jobs)))
+    idle: List[_Worker] = []
+    busy: Dict[Any, _Worker] = {}  # conn -> воркер
+
+    try:
+        while pending or busy:
+            while pending and len(busy) < workers:
+                i = pending.popleft()
+                job = jobs[i]
+                if job.kind not in _PARSERS:
+                    yield i, ParseResult(job.tag, error=f"unknown job kind '{job.kind}'")
+                    continue
+                w = idle.pop() if idle else _Worker(mem_mb)
+                try:
+                    w.submit(i, job, timeout)
+                except OSError:
+                    # воркер успел умереть между заданиями — заменяем
+                    w.kill()
+                    w = _Worker(mem_mb)
+                    w.submit(i, job, timeout)
+                busy[w.conn] = w
+
+            if not busy:
+                continue
+
+            next_deadline = min(w.deadline for w in busy.values())
+            for conn in wait(list(busy), timeout=max(0.0, next_deadline - time.monotonic())):
+                w = busy.pop(conn)
+                try:
+                    df, error, retire = conn.recv()
+                    transient = False
+                except EOFError:
+                    # воркер умер, ничего не прислав (OOM-killer, segfault в нативном коде)
+                    df, error, retire, transient = None, "worker crashed", True, True
+                if retire:
+                    w.kill()
+                else:
+                    idle.append(w)
+                yield w.job, ParseResult(jobs[w.job].tag, df=df, error=error, transient=transient)
+
+            now = time.monotonic()
+            for conn, w in list(busy.items()):
+                if w.deadline <= now:
+                    busy.pop(conn)
+                    w.kill()
+                    yield w.job, ParseResult(jobs[w.job].tag, error=f"timeout after {timeout:g}s", transient=True)
+    finally:
+        for w in idle:
+            w.close()
+        for w in busy.values():
+            w.kill()
+
+
+def run_parse_jobs(
+    jobs: List[ParseJob],
+    max_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    mem_mb: Optional[int] = None,
+) -> List[ParseResult]:
+    """Как iter_parse_jobs, но возвращает все ParseResult списком в порядке jobs."""
+    results: List[Optional[ParseResult]] = [None] * len(jobs)
+    for i, res in iter_parse_jobs(jobs, max_workers, timeout, mem_mb):
+        results[i] = res
+    return results  # type: ignore[return-value]
@@ -12,7 +12,7 @@ from __future__ import annotations
 
 import io
 import re
-from typing import Dict, Iterable, List, Tuple, Optional
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Union
 
 import numpy as np
 import pandas as pd
@@ -305,7 +305,49 @@ def _build_rfq_index(df: pd.DataFrame) -> Dict[Tuple[str,str], float]:
             idx[key] = float(r["Unit Price"])
     return idx
 
-def align_offers(boq_df: pd.DataFrame, supplier_to_rfq: Dict[str, pd.DataFrame]) -> Tuple[List[str], pd.DataFrame]:
+OFFER_PRECEDENCES = ("newest", "lowest")
+
+def build_price_index(parts: List[Tuple[pd.DataFrame, Optional[str]]], precedence: str = "newest") -> Dict[Tuple[str,str], float]:
+    """
+    Сводит несколько КП одного поставщика в один индекс (desc_key, unit_key) -> цена.
+    parts: [(rfq_df, modifiedTime)] в исходном порядке файлов.
+    При дублях позиции побеждает:
+      - newest: строка из самого свежего файла (по modifiedTime, при равенстве — более ранний в списке);
+      - lowest: минимальная цена.
+    Дубли внутри одного файла (при любом правиле) разрешаются как в _build_rfq_index — первым вхождением.
+    """
+    if precedence not in OFFER_PRECEDENCES:
+        raise ValueError(f"Unknown offer precedence '{precedence}', expected one of {OFFER_PRECEDENCES}")
+
+    frames = []
+    for order, (df, modified) in enumerate(parts):
+        if df is None or df.empty:
+            continue
+        f = df[["desc_key","unit_key","Unit Price"]].copy()
+        f["__modified__"] = modified or ""
+        f["__order__"] = order
+        f["__row__"] = np.arange(len(f))
+        frames.append(f)
+    if not frames:
+        return {}
+
+    merged = pd.concat(frames, ignore_index=True)
+    # внутри одного файла — первое вхождение, независимо от правила между файлами
+    merged = merged.drop_duplicates(["__order__","desc_key","unit_key"], keep="first")
+    if precedence == "lowest":
+        merged = merged.sort_values(["Unit Price","__order__","__row__"], kind="stable")
+    else:
+        merged = merged.sort_values(["__modified__","__order__","__row__"], ascending=[False, True, True], kind="stable")
+    merged = merged.drop_duplicates(["desc_key","unit_key"], keep="first")
+    return dict(zip(zip(merged["desc_key"], merged["unit_key"]), merged["Unit Price"].astype(float)))
+
+def align_offers(
+    boq_df: pd.DataFrame,
+    supplier_to_rfq: Dict[str, Union[pd.DataFrame, Dict[Tuple[str,str], float]]],
+) -> Tuple[List[str], pd.DataFrame]:
+    """
+    supplier_to_rfq: поставщик -> RFQ DataFrame или готовый индекс цен (см. build_price_index).
+    """
     suppliers = list(supplier_to_rfq.keys())
 
     base = boq_df.copy()
@@ -327,11 +369,11 @@ def align_offers(boq_df: pd.DataFrame, supplier_to_rfq: Dict[str, pd.DataFrame])
         table[match_col] = "—"
         table[notes_col] = ""
 
-        if rfq_df is None or rfq_df.empty:
+        if rfq_df is None or len(rfq_df) == 0:
             table[notes_col] = "No RFQ"
             continue
 
-        idx_map = _build_rfq_index(rfq_df)
+        idx_map = rfq_df if isinstance(rfq_df, dict) else _build_rfq_index(rfq_df)
 
         prices, totals, matches, notes = [], [], [], []
         for _, row in base.iterrows():
@@ -369,3 +411,24 @@ def align_offers(boq_df: pd.DataFrame, supplier_to_rfq: Dict[str, pd.DataFrame])
         pass
 
     return suppliers, table
+
+def iter_aligned_blocks(
+    boq_df: pd.DataFrame,
+    supplier_to_rfq: Dict[str, Union[pd.DataFrame, Dict[Tuple[str,str], float]]],
+    block_rows: int,
+) -> Iterator[pd.DataFrame]:
+    """
+    То же, что align_offers, но сводная таблица отдаётся блоками по block_rows строк BOQ:
+    в памяти одновременно только один блок, а не вся таблица BOQ × поставщики.
+    Лучше передавать готовые индексы цен (build_price_index) — иначе индекс строится на каждый блок.
+    """
+    base = boq_df
+    try:
+        # сортируем BOQ заранее так же, как align_offers сортирует таблицу, — блоки идут в итоговом порядке
+        base = base.sort_values(by=["No"], key=lambda s: pd.to_numeric(s, errors="coerce"), kind="stable")
+    except Exception:
+        pass
+    base = base.reset_index(drop=True)
+    for start in range(0, len(base), max(1, block_rows)):
+        _, block = align_offers(base.iloc[start:start + block_rows], supplier_to_rfq)
+        yield block
@@ -0,0 +1,184 @@
+# run_journal.py
+# -*- coding: utf-8 -*-
+"""
+Журнал прогона (чекпоинты) в локальной папке RUN_JOURNAL_DIR:
+- journal.json — по каждому проекту: какие стадии (fetched/parsed/aligned/written) завершены
+  и с каким хэшем входных данных.
+- blobs/ — скачанные из Drive файлы по md5Checksum (Drive отдаёт его для бинарных файлов).
+- artifacts/ — результаты парсинга (по sha256 содержимого файла) и индексы цен для сведения (по хэшу входов проекта).
+
+Одна «логическая синхронизация» длится, пока все проекты не дойдут до written
+(или не будут окончательно отбракованы — failed) и ни один файл не упал по временной причине.
+Если прогон упал посередине (квота Sheets, 5xx Drive), следующий запуск продолжает ту же
+синхронизацию с первой незавершённой стадии. После успешного завершения следующий запуск
+начинает новую синхронизацию: стадии и артефакты сбрасываются, из кэша файлов Drive
+остаются только файлы, использованные завершившимся прогоном.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+import uuid
+from typing import Any, Dict, Optional, Set
+
+RUN_JOURNAL_DIR = os.getenv("RUN_JOURNAL_DIR", ".supplypilot_cache")
+
+# md5 файлов из кэша, которые понадобились в этом процессе (остальные удаляются в finish_sync)
+_used_blobs: Set[str] = set()
+
+STAGES = ("fetched", "parsed", "aligned", "written")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def combined_hash(*parts: str) -> str:
+    """Хэш от упорядоченного набора хэшей/строк."""
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# ===== Кэш файлов Drive =====
+def _blob_path(md5: str, root: Optional[str] = None) -> str:
+    return os.path.join(root or RUN_JOURNAL_DIR, "blobs", md5)
+
+
+def load_blob(md5: Optional[str]) -> Optional[bytes]:
+    """Ранее скачанный файл с таким md5Checksum, если он есть и не повреждён."""
+    if not md5:
+        return None
+    _used_blobs.add(md5)
+    try:
+        with open(_blob_path(md5), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if hashlib.md5(data).hexdigest() != md5:
+        return None
+    return data
+
+
+def store_blob(md5: Optional[str], data: bytes) -> None:
+    if md5:
+        _used_blobs.add(md5)
+        _atomic_write(_blob_path(md5), data)
+
+
+# ===== Журнал стадий =====
+class RunJournal:
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or RUN_JOURNAL_DIR
+        self.path = os.path.join(self.root, "journal.json")
+        self.artifacts_dir = os.path.join(self.root, "artifacts")
+        self.state: Dict[str, Any] = self._load()
+
+        if not self.state or self.state.get("complete", True):
+            self._start_sync()
+        else:
+            print(f"[INFO] Resuming sync {self.state['sync_id']}")
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self) -> None:
+        data = json.dumps(self.state, ensure_ascii=False, indent=2).encode("utf-8")
+        _atomic_write(self.path, data)
+
+    def _start_sync(self) -> None:
+        shutil.rmtree(self.artifacts_dir, ignore_errors=True)
+        self.state = {
+            "sync_id": uuid.uuid4().hex,
+            "started_at": time.time(),
+            "complete": False,
+            "projects": {},
+        }
+        self._save()
+
+    # --- стадии ---
+    def is_done(self, project: str, stage: str, inputs_hash: str) -> bool:
+        rec = self.state["projects"].get(project, {}).get(stage)
+        return bool(rec) and rec.get("inputs") == inputs_hash
+
+    def mark_done(self, project: str, stage: str, inputs_hash: str) -> None:
+        stages = self.state["projects"].setdefault(project, {})
+        stages[stage] = {"inputs": inputs_hash, "at": time.time()}
+        # последующие стадии посчитаны от других входов — больше не действительны
+        for later in STAGES[STAGES.index(stage) + 1:]:
+            if stages.get(later, {}).get("inputs") != inputs_hash:
+                stages.pop(later, None)
+        self._save()
+
+    def mark_failed(self, project: str, inputs_hash: str, reason: str) -> None:
+        """Проект не может быть записан при этих входах (например, BOQ не парсится) — повторять бессмысленно."""
+        stages = self.state["projects"].setdefault(project, {})
+        stages["failed"] = {"inputs": inputs_hash, "reason": reason, "at": time.time()}
+        self._save()
+
+    def is_settled(self, project: str, inputs_hash: str) -> bool:
+        """Проект доведён до конца в этой синхронизации: записан или окончательно отбракован."""
+        return self.is_done(project, "written", inputs_hash) or self.is_done(project, "failed", inputs_hash)
+
+    def clear_stage(self, project: str, stage: str) -> None:
+        """Сбрасывает стадию и все последующие (например, если её артефакт не читается)."""
+        stages = self.state["projects"].get(project, {})
+        for st in STAGES[STAGES.index(stage):]:
+            stages.pop(st, None)
+        self._save()
+
+    def finish_sync(self) -> None:
+        self.state["complete"] = True
+        self.state["finished_at"] = time.time()
+        self._save()
+        self._prune_blobs()
+
+    def _prune_blobs(self) -> None:
+        # Прогон, завершивший синхронизацию, прошёл по всем актуальным файлам Drive —
+        # всё, что он не трогал, это старые версии. Пустой набор = Drive не ответил, ничего не трогаем.
+        if not _used_blobs:
+            return
+        blobs_dir = os.path.join(self.root, "blobs")
+        try:
+            names = os.listdir(blobs_dir)
+        except OSError:
+            return
+        for name in names:
+            if name not in _used_blobs:
+                try:
+                    os.remove(os.path.join(blobs_dir, name))
+                except OSError:
+                    pass
+
+    # --- артефакты (результаты стадий) ---
+    def _artifact_path(self, kind: str, key: str) -> str:
+        return os.path.join(self.artifacts_dir, kind, f"{key}.pkl")
+
+    def load_artifact(self, kind: str, key: str) -> Optional[Any]:
+        try:
+            with open(self._artifact_path(kind, key), "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def save_artifact(self, kind: str, key: str, obj: Any) -> None:
+        _atomic_write(self._artifact_path(kind, key), pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))